@@ -0,0 +1,103 @@
+"""
+Startup benchmark of the command-line entry points, based on python -X importtime
+
+Every entry module is imported in a fresh interpreter, the best cumulative import time of a few runs is
+reported, and the run fails when a report backend (Google clients, xlsxwriter, openpyxl) is imported at
+startup or an entry point is slower than --budget-ms.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 300] [--top 5]
+
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry modules of the console scripts, with the project directory they are imported from
+ENTRY_POINTS = [
+    ('reportify', 'reportify.main'),
+    ('reportify', 'reportify.batch'),
+    ('sheetify', 'sheetify.main'),
+    ('excelify', 'excelify.main'),
+    ('excelify', 'excelify.batch'),
+]
+
+# Report backends, they are imported only once a run knows which report it writes
+BACKEND_MODULES = ('googleapiclient', 'google_auth_oauthlib', 'google.oauth2', 'openpyxl', 'xlsxwriter')
+
+# The settings modules exit without these, placeholders are used for the ones that are not set
+REQUIRED_ENV_VARS = ('WORKSPACE_NAME', 'CLOCKIFY_API_KEY', 'CLOCKIFY_BASE_URL', 'CLOCKIFY_WORKSPACE_ID', 'EXCEL_DIRECTORY',
+                     'GOOGLE_SHEETS_CREDENTIALS_FILE', 'GOOGLE_OAUTH_TOKEN_FILE', 'SPREADSHEET_ID')
+
+
+def measure_import(project: str, module: str) -> tuple[int, dict[str, int], set[str]]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Args:
+        project (str): Project directory the module is imported from
+        module (str): Dotted name of the module
+
+    Returns:
+        tuple: Cumulative import time of the module in microseconds, cumulative times of its direct imports
+            and the names of all modules it imported
+
+    """
+    env = dict(os.environ)
+    for name in REQUIRED_ENV_VARS:
+        env.setdefault(name, 'benchmark')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.join(REPOSITORY_DIR, project), env.get('PYTHONPATH')]))
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, capture_output=True, text=True)
+    if result.returncode:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f'Importing {module} failed:\n' + '\n'.join(errors))
+
+    # Modules are listed after their own imports, nested ones indented by two spaces per level
+    imported, direct_imports = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() != module:
+            imported, direct_imports = {}, {}
+        elif depth == 1:
+            direct_imports[name.strip()] = int(cumulative)
+        imported[name.strip()] = int(cumulative)
+    return imported[module], direct_imports, set(imported)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Measure the import time of the command-line entry points')
+    parser.add_argument('--runs', type=int, default=5, help='Imports per entry point, the fastest one is reported')
+    parser.add_argument('--budget-ms', type=float, help='Fail when an entry point takes longer to import')
+    parser.add_argument('--top', type=int, default=5, help='Number of the slowest dependencies listed per entry point')
+    args = parser.parse_args()
+
+    failures = []
+    for project, module in ENTRY_POINTS:
+        cumulative, direct_imports, imported = min((measure_import(project, module) for _ in range(args.runs)), key=lambda run: run[0])
+        total_ms = cumulative / 1000
+
+        print(f'{module:<36} {total_ms:8.1f} ms')
+        for name in sorted(direct_imports, key=direct_imports.get, reverse=True)[:args.top]:
+            print(f'    {name:<32} {direct_imports[name] / 1000:8.1f} ms')
+
+        backends = [backend for backend in BACKEND_MODULES if any(name == backend or name.startswith(f'{backend}.') for name in imported)]
+        if backends:
+            failures.append(f'{module} imports report backends at startup: {", ".join(backends)}')
+        if args.budget_ms and total_ms > args.budget_ms:
+            failures.append(f'{module} imports in {total_ms:.1f} ms, over the budget of {args.budget_ms:.1f} ms')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
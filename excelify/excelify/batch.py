@@ -0,0 +1,156 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable
+import os
+import json
+import time
+import click
+from tqdm import tqdm
+from excelify.clockify_handler import ClockifyAPI
+from excelify.cache import TimeEntriesCache
+from excelify.config.settings import CLOCKIFY_API_KEY, CLOCKIFY_WORKSPACE_ID, CLOCKIFY_CACHE_PATH, CLOCKIFY_CACHE_MAX_SIZE_MB, REPORT_TIMEZONE, EXCEL_DIRECTORY, EXCEL_CONSTANT_MEMORY, EXCEL_TOTALS, EXCEL_RENDER_WORKERS, TOTALS_MODES
+from excelify.main import click_validate_dates, click_validate_auth_data, report_title
+from excelify.report_model import ReportGrid
+
+
+def load_manifest(manifest_path: str, default_workspace_id: str) -> list[dict]:
+    """
+    Read the reports of a batch run from a JSON manifest
+
+    The manifest is a list of objects with the project name, the start and stop date (YYYY-MM-DD) and
+    an optional workspace_id, reports without one are built in the default workspace.
+
+    Args:
+        manifest_path (str): Path to the manifest file
+        default_workspace_id (str): Workspace of reports without a workspace_id
+
+    Returns:
+        list[dict]: Reports with validated dates, in manifest order
+
+    """
+    try:
+        with open(manifest_path) as manifest_file:
+            entries = json.load(manifest_file)
+    except (OSError, ValueError) as err:
+        raise click.BadParameter(f'Invalid manifest file: {err}')
+    if not isinstance(entries, list) or not entries:
+        raise click.BadParameter('Invalid manifest file: expected a non-empty list of reports.')
+
+    jobs = []
+    for number, entry in enumerate(entries, start=1):
+        try:
+            start, stop = click_validate_dates(datetime.strptime(entry['start'], '%Y-%m-%d'), datetime.strptime(entry['stop'], '%Y-%m-%d'))
+            job = {'project': entry['project'], 'start': start, 'stop': stop, 'workspace_id': entry.get('workspace_id', default_workspace_id)}
+            click_validate_auth_data(None, job['workspace_id'], None)
+        except KeyError as err:
+            raise click.BadParameter(f'Invalid manifest entry {number}: missing {err}.')
+        except (TypeError, ValueError) as err:
+            raise click.BadParameter(f'Invalid manifest entry {number}: {err}.')
+        except click.BadParameter as err:
+            raise click.BadParameter(f'Invalid manifest entry {number}: {err.message}')
+
+        job['file_name'] = f"{job['project']} [{start} | {stop}].xlsx"
+        jobs.append(job)
+
+    return jobs
+
+
+def render_excel_report(report: ReportGrid, file_path: str, title: str, start_date: str, stop_date: str,
+                        totals: str, constant_memory: bool, on_day: Callable[[], None] | None = None) -> float:
+    # Entry point of the render workers, the report grid arrives pickled and the workbook is written by the worker
+    from excelify.sheet_handler import write_excel_report
+
+    started_at = time.perf_counter()
+    write_excel_report(report, file_path, title, start_date, stop_date, totals, constant_memory, on_day)
+    return time.perf_counter() - started_at
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-m', '--manifest', required=True, type=click.Path(exists=True, dir_okay=False), help='JSON list of reports with project, start, stop and optional workspace_id')
+@click.option('--api-key', prompt=False, help='Clockify API key')
+@click.option('--workspace-id', prompt=False, help='Clockify workspace ID of reports without a workspace_id')
+@click.option('--dir_path', prompt=False, help='Path to directory where the Excel files will be saved')
+@click.option('--no-cache', is_flag=True, default=False, help='Do not read or write the local time entries cache')
+@click.option('--refresh', is_flag=True, default=False, help='Ignore cached time entries and download them again')
+@click.option('--timezone', 'report_timezone', prompt=False, help='Time zone of the report slots, e.g. Europe/Prague')
+@click.option('--totals', type=click.Choice(TOTALS_MODES, case_sensitive=False), help='How totals are written: formula text, numbers or formulas with cached numbers')
+@click.option('--workers', type=click.IntRange(min=1), help='Number of processes rendering reports in parallel')
+def main(manifest: str, api_key: str | None, workspace_id: str | None, dir_path: str | None, no_cache: bool, refresh: bool, report_timezone: str | None, totals: str | None, workers: int | None):
+    dir_path = dir_path if dir_path else EXCEL_DIRECTORY
+    totals = totals if totals else EXCEL_TOTALS
+    print("")
+    click_validate_auth_data(api_key, workspace_id, dir_path)
+    if totals not in TOTALS_MODES:
+        raise click.BadParameter(f'Invalid totals mode: {totals}.')
+    jobs = load_manifest(manifest, workspace_id if workspace_id else CLOCKIFY_WORKSPACE_ID)
+
+    # Reports that already exist, or are listed twice, are skipped before anything is downloaded
+    pending_jobs, pending_names = [], set()
+    for job in jobs:
+        if os.path.exists(os.path.join(dir_path, job['file_name'])):
+            print(f"File '{job['file_name']}' already exists, skipping it.")
+        elif job['file_name'] in pending_names:
+            print(f"File '{job['file_name']}' is listed more than once, skipping it.")
+        else:
+            pending_names.add(job['file_name'])
+            pending_jobs.append(job)
+
+    jobs_by_workspace = defaultdict(list)
+    for job in pending_jobs:
+        jobs_by_workspace[job['workspace_id']].append(job)
+
+    # Projects, users and time entries are fetched once per workspace for all of its reports
+    cache = None if no_cache else TimeEntriesCache(CLOCKIFY_CACHE_PATH, CLOCKIFY_CACHE_MAX_SIZE_MB, refresh=refresh)
+    for job_workspace_id, workspace_jobs in jobs_by_workspace.items():
+        clockify_api = ClockifyAPI(api_key=CLOCKIFY_API_KEY if not api_key else api_key,
+                                   workspace_id=job_workspace_id,
+                                   cache=cache,
+                                   report_timezone=report_timezone if report_timezone else REPORT_TIMEZONE)
+
+        projects = {project['name']: project['id'] for project in clockify_api.get_all_projects_in_workspace()}
+        missing_projects = sorted({job['project'] for job in workspace_jobs if job['project'] not in projects})
+        if missing_projects:
+            raise click.BadParameter(f'Projects {", ".join(missing_projects)} do not exist in the workspace {job_workspace_id}.')
+
+        periods = [(projects[job['project']],
+                    datetime.strptime(job['start'], '%Y-%m-%d').replace(tzinfo=clockify_api.report_timezone),
+                    (datetime.strptime(job['stop'], '%Y-%m-%d') + timedelta(days=1)).replace(tzinfo=clockify_api.report_timezone))
+                   for job in workspace_jobs]
+        reports = clockify_api.fetch_project_reports(clockify_api.get_workspace_users(), periods)
+        for job, report in zip(workspace_jobs, reports):
+            job['report'] = report
+
+    written_jobs = [job for job in pending_jobs if job['report'].num_users]
+    for job in pending_jobs:
+        if not job['report'].num_users:
+            print(f"No users found in the project for '{job['file_name']}', skipping it.")
+
+    progress_bar = tqdm(total=sum(job['report'].num_days for job in written_jobs), desc='Processing', unit='day', leave=True, colour='#3FDCEE',
+                        ascii=True, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}, {rate_fmt}{postfix}]')
+
+    workers = min(workers if workers else EXCEL_RENDER_WORKERS, len(written_jobs))
+    started_at = time.perf_counter()
+    if workers > 1:
+        # Rendering is CPU bound in xlsxwriter, so every worker process writes whole workbooks on its own core
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(render_excel_report, job['report'], os.path.join(dir_path, job['file_name']), report_title(job['start'], job['stop']),
+                                       job['start'], job['stop'], totals, EXCEL_CONSTANT_MEMORY): job for job in written_jobs}
+            for future in as_completed(futures):
+                futures[future]['seconds'] = future.result()
+                progress_bar.update(futures[future]['report'].num_days)
+    else:
+        for job in written_jobs:
+            job['seconds'] = render_excel_report(job['report'], os.path.join(dir_path, job['file_name']), report_title(job['start'], job['stop']),
+                                                 job['start'], job['stop'], totals, EXCEL_CONSTANT_MEMORY, on_day=lambda: progress_bar.update(1))
+    elapsed = time.perf_counter() - started_at
+    progress_bar.close()
+    print("")
+
+    print(f"Data successfully updated in {len(written_jobs)} of {len(jobs)} Excel files in {elapsed:.1f} s.")
+    for job in written_jobs:
+        print(f"  - file://{os.path.abspath(os.path.join(dir_path, job['file_name']))} ({job['seconds']:.2f} s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -31,4 +31,19 @@ WORKSPACE_NAME = os.getenv('WORKSPACE_NAME')
 CLOCKIFY_API_KEY = os.getenv('CLOCKIFY_API_KEY')
 CLOCKIFY_BASE_URL = os.getenv('CLOCKIFY_BASE_URL', 'https://api.clockify.me/api/v1')
 CLOCKIFY_WORKSPACE_ID = os.getenv('CLOCKIFY_WORKSPACE_ID')
-EXCEL_DIRECTORY = os.getenv('EXCEL_DIRECTORY')
\ No newline at end of file
+CLOCKIFY_PAGE_SIZE = int(os.getenv('CLOCKIFY_PAGE_SIZE', 1000))
+CLOCKIFY_MAX_WORKERS = int(os.getenv('CLOCKIFY_MAX_WORKERS', 8))
+CLOCKIFY_RATE_LIMIT = float(os.getenv('CLOCKIFY_RATE_LIMIT', 50))
+CLOCKIFY_CACHE_PATH = os.getenv('CLOCKIFY_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'excelify', 'time_entries.sqlite3'))
+CLOCKIFY_CACHE_MAX_SIZE_MB = float(os.getenv('CLOCKIFY_CACHE_MAX_SIZE_MB', 256))
+CLOCKIFY_SYNC_WINDOW_HOURS = float(os.getenv('CLOCKIFY_SYNC_WINDOW_HOURS', 48))
+CLOCKIFY_VALIDATION_TTL_HOURS = float(os.getenv('CLOCKIFY_VALIDATION_TTL_HOURS', 24))
+CLOCKIFY_REQUEST_TIMEOUT = float(os.getenv('CLOCKIFY_REQUEST_TIMEOUT', 30))
+REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'Europe/Prague')
+REQUEST_RETRY_MAX_SECONDS = float(os.getenv('REQUEST_RETRY_MAX_SECONDS', 300))
+EXCEL_DIRECTORY = os.getenv('EXCEL_DIRECTORY')
+EXCEL_CONSTANT_MEMORY = os.getenv('EXCEL_CONSTANT_MEMORY', 'true').lower() in ('1', 'true', 'yes')
+# Totals are written as formula text, as numbers computed in Python, or as formulas with those numbers cached
+TOTALS_MODES = ('formula', 'number', 'cached')
+EXCEL_TOTALS = os.getenv('EXCEL_TOTALS', 'formula').lower()
+EXCEL_RENDER_WORKERS = int(os.getenv('EXCEL_RENDER_WORKERS', os.cpu_count() or 1))
\ No newline at end of file
@@ -0,0 +1,92 @@
+from array import array
+from datetime import date, timedelta
+from typing import Iterator
+from excelify.slots import SLOT_MINUTES, SLOTS_PER_DAY, EPOCH_ORDINAL, TIME_SLOT_LABELS
+
+
+class ReportGrid:
+    """
+    Users x days x 15-minute slots of a report, stored as interned description ids
+
+    Slot values index into `descriptions`, 0 marks an empty slot. The slots of one user are contiguous,
+    so an entry spanning midnight is still written with a single slice assignment.
+
+    Args:
+        first_day (date): First day of the report
+        num_days (int): Number of days in the report
+
+    """
+    __slots__ = ('first_day', 'num_days', 'descriptions', 'users_id', 'users_name', 'slots', '_description_ids')
+
+    def __init__(self, first_day: date, num_days: int) -> None:
+        self.first_day = first_day
+        self.num_days = num_days
+        self.descriptions = ['']
+        self.users_id = []
+        self.users_name = []
+        self.slots = array('i')
+        self._description_ids = {'': 0}
+
+    @property
+    def num_users(self) -> int:
+        return len(self.users_id)
+
+    def day(self, day_index: int) -> date:
+        return self.first_day + timedelta(days=day_index)
+
+    def intern(self, description: str) -> int:
+        description_id = self._description_ids.get(description)
+        if description_id is None:
+            description_id = self._description_ids[description] = len(self.descriptions)
+            self.descriptions.append(description)
+        return description_id
+
+    def add_user(self, user_id: str, user_name: str, intervals: list[tuple[int, int, str]]) -> None:
+        """
+        Append a user column filled from work intervals
+
+        Args:
+            user_id (str): The user ID
+            user_name (str): The user name shown in the report header
+            intervals (list[tuple[int, int, str]]): First slot, last slot (inclusive, counted from the epoch) and
+                description of every entry; later intervals overwrite earlier ones
+
+        """
+        user_slots = array('i', bytes(array('i').itemsize * self.num_days * SLOTS_PER_DAY))
+        slot_offset = (self.first_day.toordinal() - EPOCH_ORDINAL) * SLOTS_PER_DAY + 1
+
+        for first_slot, last_slot, description in intervals:
+            begin = max(first_slot - slot_offset, 0)
+            end = min(last_slot - slot_offset + 1, len(user_slots))
+            if begin < end:
+                user_slots[begin:end] = array('i', [self.intern(description)]) * (end - begin)
+
+        self.users_id.append(user_id)
+        self.users_name.append(user_name)
+        self.slots.extend(user_slots)
+
+    def day_slots(self, user_index: int, day_index: int) -> array:
+        start = (user_index * self.num_days + day_index) * SLOTS_PER_DAY
+        return self.slots[start:start + SLOTS_PER_DAY]
+
+    def day_minutes(self, day_index: int) -> list[int]:
+        # Worked minutes of every user on the day, counted straight from the occupied slots
+        return [(SLOTS_PER_DAY - self.day_slots(user_index, day_index).count(0)) * SLOT_MINUTES
+                for user_index in range(self.num_users)]
+
+    def slot_rows(self, day_index: int) -> Iterator[tuple[int, ...]]:
+        # Description ids of every user for each slot of the day, zipped lazily from the user columns
+        return zip(*(self.day_slots(user_index, day_index) for user_index in range(self.num_users)))
+
+    def day_rows(self, day_index: int) -> Iterator[list[str]]:
+        """
+        Yield the header row and the slot rows of a day one by one, as they are written to the report
+
+        Args:
+            day_index (int): Index of the day in the report
+
+        """
+        descriptions = self.descriptions
+        yield [str(self.day(day_index))] + self.users_name
+        for time_slot, description_ids in zip(TIME_SLOT_LABELS, self.slot_rows(day_index)):
+            yield [time_slot, *map(descriptions.__getitem__, description_ids)]
@@ -0,0 +1,76 @@
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, TypeVar
+
+T = TypeVar('T')
+
+# Throttling, timeouts and server side failures, everything else is a permanent error of the request
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class RetryableError(Exception):
+    """
+    Transient failure of an API call that is worth sending again
+
+    Args:
+        status (int): HTTP status of the failed response, None for connection errors
+        retry_after (str): Value of the Retry-After header, if the server sent one
+
+    """
+    def __init__(self, status: int | None, retry_after: str | None = None) -> None:
+        super().__init__(f"Request failed with status {status}." if status else "Request failed to connect.")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter shared by the Clockify and Google Sheets clients
+
+    A Retry-After header sent by the server takes precedence over the computed delay. Once the next
+    delay would exceed max_elapsed seconds since the first attempt, the last error is raised.
+
+    Args:
+        max_elapsed (float): Maximum total time spent retrying one call, in seconds
+        base_delay (float): Upper bound of the first delay, doubled after every attempt
+        max_delay (float): Upper bound of a single delay
+
+    """
+    def __init__(self, max_elapsed: float, base_delay: float = 1.0, max_delay: float = 64.0) -> None:
+        self.max_elapsed = max_elapsed
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def run(self, send: Callable[[], T]) -> T:
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                return send()
+            except RetryableError as err:
+                delay = self._retry_after_seconds(err.retry_after)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if time.monotonic() - started_at + delay > self.max_elapsed:
+                    raise
+                if err.status == 429:
+                    print("Data transfer is temporarily paused due to exceeding API request limits. "
+                          f"The system will resume operation in {delay:.0f} seconds...")
+                time.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    def _retry_after_seconds(retry_after: str | None) -> float | None:
+        # Retry-After is either a number of seconds or an HTTP date
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
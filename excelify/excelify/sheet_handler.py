@@ -1,119 +1,240 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from xlsxwriter import Workbook, utility
+from excelify.report_model import ReportGrid
+from excelify.slots import TIME_SLOT_LABELS
+from typing import Callable
 import calendar
 
+MINUTES_PER_DAY = 24 * 60
+TIME_FORMAT = '[h]:mm'
+
+class ExcelFormats:
+    """
+    Cell formats of a report, added to the workbook once and shared by all days
+
+    Args:
+        workbook (Workbook): The workbook the formats belong to
+
+    """
+    def __init__(self, workbook: Workbook) -> None:
+        self.title = workbook.add_format({'bold': True, 'font_size': 20, 'bg_color': 'FFE3E6', 'color': 'AC3A4D'})
+        self.table_header = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': '006100', 'color': 'FFFFFF', 'font_size': 13})
+        self.time_period = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True})
+        self.small_description = workbook.add_format({'align': 'left', 'valign': 'vcenter', 'border': 1})
+        self.big_description = workbook.add_format({'align': 'fill', 'valign': 'vcenter', 'border': 1, 'text_wrap': False, 'shrink': True})
+        self.total = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'DFF0E2', 'color': '006100'})
+        self.total_name = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'AC3A4D', 'color': 'FFDBE0'})
+        self.all_total = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'AC3A4D', 'color': 'FFDBE0', 'font_size': 13})
+        self.buffer_name = workbook.add_format({'align': 'left', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'FFE3E6', 'color': '9C0006'})
+        self.buffer = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'FFE3E6', 'color': '9C0006'})
+        self.total_time = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'DFF0E2', 'color': '006100', 'num_format': TIME_FORMAT})
+        self.all_total_time = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'AC3A4D', 'color': 'FFDBE0', 'font_size': 13, 'num_format': TIME_FORMAT})
+        self.buffer_time = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'FFE3E6', 'color': '9C0006', 'num_format': TIME_FORMAT})
+        self._description_formats = []
+
+    def description_formats(self, descriptions: list[str]) -> list:
+        """
+        Format of every interned description of the report, indexed by description id
+
+        Descriptions are only ever appended to a report, so each one is measured once per workbook.
+
+        """
+        for description in descriptions[len(self._description_formats):]:
+            self._description_formats.append(self.small_description if len(description) <= 10 else self.big_description)
+        return self._description_formats
+
 
 def set_column_widths(worksheet, max_col, widths):
     for col in range(max_col):
         worksheet.set_column(col, col, widths.get(col + 1, 20))
 
+def write_row_runs(worksheet: Workbook.worksheet_class, row: int, values: list[str], cell_formats: list) -> None:
+    # write_row takes a single format, so every run of cells sharing a format is written at once
+    run_start = 0
+    for col in range(1, len(values) + 1):
+        if col == len(values) or cell_formats[col] is not cell_formats[run_start]:
+            worksheet.write_row(row, run_start, values[run_start:col], cell_formats[run_start])
+            run_start = col
+
 def generate_total_rows(current_date: str, start_row: int, number_users: int, num_rows: int = 96) -> list[list[str]]:
     total_formula_row = []
     for col_index in range(2, number_users + 2):
         column_letter = utility.xl_col_to_name(col_index - 1)
         count_formula = f"COUNTIF({column_letter}{start_row}:{column_letter}{start_row + num_rows - 1}, \"<>\")"
-        total_minutes = f"{count_formula} * 15"
-        formatted_time_formula = f"=TEXT(INT({total_minutes} / 60), \"0\") & \":\" & TEXT(MOD({total_minutes}, 60), \"00\")"
-        total_formula_row.append(formatted_time_formula)
+        total_formula_row.append(format_minutes_formula(f"{count_formula} * 15"))
 
     return [f'TOTAL [{current_date}]'] + total_formula_row
 
-def generate_all_totals(number_users: int, num_days: int, start_date: str, stop_date: str) -> tuple[list[str], list[dict[int, str]]]:
+def format_minutes_formula(total_minutes: str) -> str:
+    # Text H:MM of a minutes expression, the form of every formula total in the report
+    return f"=TEXT(INT({total_minutes} / 60), \"0\") & \":\" & TEXT(MOD({total_minutes}, 60), \"00\")"
+
+def generate_total_time_formulas(start_row: int, number_users: int, num_rows: int = 96) -> list[str]:
+    # Numeric counterpart of generate_total_rows, the worked time as a fraction of a day
+    return [f"=COUNTIF({column_letter}{start_row}:{column_letter}{start_row + num_rows - 1}, \"<>\") * 15 / {MINUTES_PER_DAY}"
+            for column_letter in (utility.xl_col_to_name(col_index) for col_index in range(1, number_users + 1))]
+
+def write_time_row(worksheet, row: int, label: str, minutes: list[int], formulas: list[str] | None, label_format, time_format) -> None:
+    # Times are written as fractions of a day, formulas keep the computed value as their cached result
+    worksheet.write(row, 0, label, label_format)
+    for col_index, user_minutes in enumerate(minutes, start=1):
+        if formulas:
+            worksheet.write_formula(row, col_index, formulas[col_index - 1], time_format, user_minutes / MINUTES_PER_DAY)
+        else:
+            worksheet.write_number(row, col_index, user_minutes / MINUTES_PER_DAY, time_format)
+
+def month_spans(first_day: date, num_days: int) -> list[tuple[int, int]]:
+    # First and past-the-end day index of every calendar month in the report
+    spans, span_start, day = [], 0, first_day
+    while span_start < num_days:
+        next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        span_end = min(span_start + (next_month - day).days, num_days)
+        spans.append((span_start, span_end))
+        span_start, day = span_end, next_month
+    return spans
+
+def month_rows(spans: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # 1-based rows from the header of the first day to the TOTAL row of the last day of every month
+    return [(span_start * 99 + 3, (span_end - 1) * 99 + 100) for span_start, span_end in spans]
+
+def generate_buffer_labels(first_day: date, spans: list[tuple[int, int]]) -> list[str]:
+    labels = []
+    for span_start, span_end in spans:
+        month_start, month_end = first_day + timedelta(days=span_start), first_day + timedelta(days=span_end - 1)
+        labels.append(f"{month_start.year}, {calendar.month_name[month_start.month]} {month_start.day:02d}-{month_end.day:02d}")
+
+    return labels
+
+def generate_all_totals(number_users: int, num_days: int, start_date: str, stop_date: str) -> tuple[list[str], list[list[str]]]:
+    # Month boundaries are computed once for all columns and every total counts the slot rows of its range directly,
+    # so each formula has a fixed size no matter how many days the month or the report has
+    first_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    spans = month_spans(first_day, num_days)
+    row_ranges = month_rows(spans)
     total_row_end = num_days * 99 + 1
-    all_total_formula_row = []
-    all_buffers_rows = []
-
-    start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
     column_letters = [utility.xl_col_to_name(idx) for idx in range(1, number_users + 1)]
 
-    for column_letter in column_letters:
-        buffer_rows, buffer_minutes_formula = [], []
-        current_date = start_datetime
-        fixed_year, fixed_month = current_date.year, current_date.month
-
-        for iteration in range(100, total_row_end + 1, 99):
-            if fixed_month < current_date.month or fixed_year < current_date.year:
-                buffer_rows.append(f"=TEXT(INT(({'+'.join(buffer_minutes_formula)}) / 60), \"0\") & \":\" & TEXT(MOD(({'+'.join(buffer_minutes_formula)}), 60), \"00\")")
-                buffer_minutes_formula.clear()
-                fixed_month, fixed_year = current_date.month, current_date.year
-
-            buffer_minutes_formula.append(f"HOUR(TIMEVALUE({column_letter}{iteration}))*60+MINUTE(TIMEVALUE({column_letter}{iteration}))")
-            current_date += timedelta(days=1)
+    def slot_minutes(column_letter: str, first_row: int, last_row: int) -> str:
+        # Slot rows are the only rows of a day block with an HH:MM label in the first column
+        return (f"COUNTIFS({column_letter}{first_row}:{column_letter}{last_row}, \"<>\", "
+                f"$A{first_row}:$A{last_row}, \"??:??\") * 15")
 
-        buffer_rows.append(f"=TEXT(INT(({'+'.join(buffer_minutes_formula)}) / 60), \"0\") & \":\" & TEXT(MOD(({'+'.join(buffer_minutes_formula)}), 60), \"00\")")
-        
-        join_buffer_cell = '+'.join(
-            [f"LEFT({column_letter}{total_row_end + idx + 4},FIND(\":\",{column_letter}{total_row_end + idx + 4})-1)*60+"
-             f"RIGHT({column_letter}{total_row_end + idx + 4},LEN({column_letter}{total_row_end + idx + 4})-FIND(\":\",{column_letter}{total_row_end + idx + 4}))" 
-            for idx in range(len(buffer_rows))]
-        )
-
-        all_total_formula_row.append(f"=TEXT(INT(({join_buffer_cell}) / 60), \"0\") & \":\" & TEXT(MOD(({join_buffer_cell}), 60), \"00\")")
-        all_buffers_rows.append({idx: row for idx, row in enumerate(buffer_rows)})
-
-    all_total_row = [f'{start_date} / {stop_date}'] + all_total_formula_row
+    all_total_row = [f'{start_date} / {stop_date}'] + [
+        format_minutes_formula(slot_minutes(column_letter, 3, total_row_end)) for column_letter in column_letters]
+    all_buffers_rows = [[label] + [format_minutes_formula(slot_minutes(column_letter, first_row, last_row)) for column_letter in column_letters]
+                        for label, (first_row, last_row) in zip(generate_buffer_labels(first_day, spans), row_ranges)]
 
     return all_total_row, all_buffers_rows
     
-def append_data_to_sheet(worksheet,  workbook: Workbook, data: list, current_date: str, users_in_work: int, start_row: int) -> None:
-    format_table_header = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': '006100', 'color': 'FFFFFF', 'font_size': 13})
-    format_time_period = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True})
-    format_small_description = workbook.add_format({'align': 'left', 'valign': 'vcenter', 'border': 1})
-    format_big_description = workbook.add_format({'align': 'fill', 'valign': 'vcenter', 'border': 1, 'text_wrap': False, 'shrink': True})
-    format_total = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'DFF0E2', 'color': '006100'})
-
+def append_data_to_sheet(worksheet, formats: ExcelFormats, report: ReportGrid, day_index: int, start_row: int, totals: str = 'formula') -> None:
     row_index = start_row + 99
-
-    for row_idx, row in enumerate(data):
-        row_format = [format_small_description if not cell else format_table_header 
-                                        if row_idx == 0 else format_time_period
-                                        if col == 0  else format_small_description 
-                                        if len(cell) <= 10 else format_big_description 
-                                        for col, cell in enumerate(row)]
-        
-        for col_index, (cell_value, format_row) in enumerate(zip(row, row_format)):
-            worksheet.write(start_row + row_idx, col_index, cell_value, format_row)
-
-    total_rows = generate_total_rows(current_date, start_row + 2, users_in_work)
-    for col_index, cell_value in enumerate(total_rows):
-        worksheet.write(row_index - 2, col_index, cell_value, format_total)
+    descriptions = report.descriptions
+    description_formats = formats.description_formats(descriptions)
+
+    # Header row and time column have fixed formats, description cells take the format of their description id
+    worksheet.write_row(start_row, 0, [str(report.day(day_index))] + report.users_name, formats.table_header)
+    slot_rows = zip(TIME_SLOT_LABELS, report.slot_rows(day_index))
+    for row, (time_slot, description_ids) in enumerate(slot_rows, start=start_row + 1):
+        write_row_runs(worksheet, row,
+                       [time_slot, *map(descriptions.__getitem__, description_ids)],
+                       [formats.time_period, *map(description_formats.__getitem__, description_ids)])
+
+    if totals == 'formula':
+        total_rows = generate_total_rows(str(report.day(day_index)), start_row + 2, report.num_users)
+        worksheet.write_row(row_index - 2, 0, total_rows, formats.total)
+    else:
+        formulas = generate_total_time_formulas(start_row + 2, report.num_users) if totals == 'cached' else None
+        write_time_row(worksheet, row_index - 2, f'TOTAL [{report.day(day_index)}]', report.day_minutes(day_index), formulas,
+                       formats.total, formats.total_time)
     
     worksheet.write(row_index - 1, 0, "")
 
-def append_all_totals(worksheet, workbook: Workbook, num_days: int, active_users_name: list, start_row: int, start_date: str, stop_date: str) -> None:
-    format_total_name = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'AC3A4D', 'color': 'FFDBE0'})
-    format_all_total = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'AC3A4D', 'color': 'FFDBE0', 'font_size': 13})
-    format_buffer_name = workbook.add_format({'align': 'left', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'FFE3E6', 'color': '9C0006'})
-    format_buffer = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'border': 1, 'bold': True, 'bg_color': 'FFE3E6', 'color': '9C0006'})
+def append_all_totals(worksheet, formats: ExcelFormats, num_days: int, active_users_name: list, start_row: int, start_date: str, stop_date: str,
+                      report: ReportGrid | None = None, totals: str = 'formula') -> None:
+    header_row = ["ALL TOTAL"] + active_users_name
+    worksheet.write_row(start_row, 0, header_row, formats.all_total)
 
-    all_totals, all_buffer = generate_all_totals(len(active_users_name), num_days, start_date, stop_date)
+    if totals != 'formula':
+        append_time_totals(worksheet, formats, report, start_row + 1, start_date, stop_date, cached=totals == 'cached')
+        return
 
-    header_row = ["ALL TOTAL"] + active_users_name
-    worksheet.write_row(start_row, 0, header_row, format_all_total)
+    all_totals, all_buffers = generate_all_totals(len(active_users_name), num_days, start_date, stop_date)
 
     for col, value in enumerate(all_totals):
-        cell_format = format_total_name if col == 0 else format_all_total
+        cell_format = formats.total_name if col == 0 else formats.all_total
         worksheet.write(start_row + 1, col, value, cell_format)
     
     start_row += 1
 
-    num_buffers = max(len(buffer_dict) for buffer_dict in all_buffer)
-
-    start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-    stop_datetime = datetime.strptime(stop_date, '%Y-%m-%d')
-    current_year = start_datetime.year
-    start_month = start_datetime.month
-
-    for number in range(num_buffers):
-
-        current_month = (start_month + number - 1) % 12 + 1
-        current_year = start_datetime.year + (start_month + number - 1) // 12
-
-        first_day_month = f"{start_datetime.day:02d}" if start_datetime.month == current_month else "01"
-        last_day_month = f"{stop_datetime.day:02d}" if stop_datetime.month == current_month else f"{calendar.monthrange(current_year, current_month)[1]:02d}"
-
-        buffer_row = [f"{current_year}, {calendar.month_name[current_month]} {first_day_month}-{last_day_month}"] + [buffer.get(number, "") for buffer in all_buffer]
-
+    for number, buffer_row in enumerate(all_buffers):
         for col, value in enumerate(buffer_row):
-            cell_format = format_buffer_name if col == 0 else format_buffer
+            cell_format = formats.buffer_name if col == 0 else formats.buffer
             worksheet.write(start_row + number + 1, col, value, cell_format)
+
+def append_time_totals(worksheet, formats: ExcelFormats, report: ReportGrid, start_row: int, start_date: str, stop_date: str, cached: bool = False) -> None:
+    """
+    Write the ALL TOTAL row and the monthly buffers as times computed from the slot model
+
+    Args:
+        worksheet (Worksheet): The report worksheet
+        formats (ExcelFormats): Formats of the workbook
+        report (ReportGrid): The report data
+        start_row (int): Row of the ALL TOTAL values, the monthly buffers follow
+        start_date (str): First day of the report (YYYY-MM-DD)
+        stop_date (str): Last day of the report (YYYY-MM-DD)
+        cached (bool): Write formulas with the computed times as cached results instead of plain numbers
+
+    """
+    spans = month_spans(report.first_day, report.num_days)
+    day_minutes = [report.day_minutes(day_index) for day_index in range(report.num_days)]
+    month_minutes = [[sum(user_minutes) for user_minutes in zip(*day_minutes[span_start:span_end])] for span_start, span_end in spans]
+    all_minutes = [sum(user_minutes) for user_minutes in zip(*month_minutes)]
+
+    column_letters = [utility.xl_col_to_name(col_index) for col_index in range(1, report.num_users + 1)]
+    first_buffer_row = start_row + 2  # 1-based row of the first monthly buffer
+
+    all_formulas = [f"=SUM({column_letter}{first_buffer_row}:{column_letter}{first_buffer_row + len(spans) - 1})"
+                    for column_letter in column_letters] if cached else None
+    write_time_row(worksheet, start_row, f'{start_date} / {stop_date}', all_minutes, all_formulas, formats.total_name, formats.all_total_time)
+
+    labels = generate_buffer_labels(report.first_day, spans)
+    for number, ((first_row, last_row), minutes) in enumerate(zip(month_rows(spans), month_minutes)):
+        formulas = None
+        if cached:
+            formulas = [f"=SUMIF($A{first_row}:$A{last_row}, \"TOTAL*\", {column_letter}{first_row}:{column_letter}{last_row})"
+                        for column_letter in column_letters]
+        write_time_row(worksheet, start_row + number + 1, labels[number], minutes, formulas, formats.buffer_name, formats.buffer_time)
+
+def write_excel_report(report: ReportGrid, file_path: str, title: str, start_date: str, stop_date: str,
+                       totals: str = 'formula', constant_memory: bool = True, on_day: Callable[[], None] | None = None) -> None:
+    """
+    Write a whole report to a new Excel workbook
+
+    Args:
+        report (ReportGrid): The report data
+        file_path (str): Path of the new workbook
+        title (str): Title written to the first row
+        start_date (str): First day of the report (YYYY-MM-DD)
+        stop_date (str): Last day of the report (YYYY-MM-DD)
+        totals (str): One of TOTALS_MODES
+        constant_memory (bool): Stream finished rows to disk instead of keeping the workbook in memory
+        on_day (Callable): Called after every written day
+
+    """
+    # constant_memory streams every finished row to disk, so rows must be written strictly in order
+    workbook = Workbook(file_path, {'constant_memory': constant_memory})
+    worksheet = workbook.add_worksheet()
+    formats = ExcelFormats(workbook)
+    set_column_widths(worksheet, report.num_users + 1, {1: 20.0, 2: 20.0})
+    worksheet.write_row(0, 0, [title] + [""] * report.num_users, formats.title)
+    worksheet.write_row(1, 0, [""])
+
+    row_index = 2
+    for day_index in range(report.num_days):
+        append_data_to_sheet(worksheet, formats, report, day_index, row_index, totals)
+        row_index += 99
+        if on_day:
+            on_day()
+
+    append_all_totals(worksheet, formats, report.num_days, report.users_name, row_index, start_date, stop_date, report, totals)
+    workbook.close()
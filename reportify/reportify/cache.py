@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date, datetime, timezone
+
+
+class TimeEntriesCache:
+    """
+    On-disk SQLite cache of Clockify time entries, one row per workspace, user, project and UTC day
+
+    Only fully elapsed days without running entries are stored, so a cached day never has to be
+    revalidated. The least recently used days are evicted once the payloads exceed max_size_mb.
+    Successful checks of an API key and workspace are stored next to them, under a hash of the key.
+
+    Args:
+        path (str): Path to the SQLite database file
+        max_size_mb (float): Maximum size of the stored payloads in megabytes
+        refresh (bool): Ignore cached days and overwrite them with fresh data
+
+    """
+    def __init__(self, path: str, max_size_mb: float, refresh: bool = False) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS time_entries (
+                    workspace_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    project_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (workspace_id, user_id, project_id, day)
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    workspace_id TEXT NOT NULL,
+                    project_id TEXT NOT NULL,
+                    synced_at REAL NOT NULL,
+                    PRIMARY KEY (workspace_id, project_id)
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS validations (
+                    api_key_hash TEXT NOT NULL,
+                    workspace_id TEXT NOT NULL,
+                    validated_at REAL NOT NULL,
+                    PRIMARY KEY (api_key_hash, workspace_id)
+                )
+            """)
+
+    def get_days(self, workspace_id: str, user_id: str, project_id: str, first_day: date, last_day: date) -> dict[date, list[dict]]:
+        if self.refresh:
+            return {}
+
+        key = (workspace_id, user_id, project_id, first_day.isoformat(), last_day.isoformat())
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT day, payload FROM time_entries "
+                "WHERE workspace_id = ? AND user_id = ? AND project_id = ? AND day BETWEEN ? AND ?", key).fetchall()
+            self.connection.execute(
+                "UPDATE time_entries SET last_used = ? "
+                "WHERE workspace_id = ? AND user_id = ? AND project_id = ? AND day BETWEEN ? AND ?", (time.time(),) + key)
+
+        return {date.fromisoformat(day): json.loads(zlib.decompress(payload)) for day, payload in rows}
+
+    def put_days(self, workspace_id: str, user_id: str, project_id: str, time_entries_by_day: dict[date, list[dict]]) -> None:
+        if not time_entries_by_day:
+            return
+
+        now = time.time()
+        rows = [(workspace_id, user_id, project_id, day.isoformat(), zlib.compress(json.dumps(time_entries).encode()), now)
+                for day, time_entries in time_entries_by_day.items()]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._evict()
+
+    def get_last_sync(self, workspace_id: str, project_id: str) -> datetime | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT synced_at FROM sync_state WHERE workspace_id = ? AND project_id = ?", (workspace_id, project_id)).fetchone()
+        return datetime.fromtimestamp(row[0], tz=timezone.utc) if row else None
+
+    def set_last_sync(self, workspace_id: str, project_id: str, synced_at: datetime) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (workspace_id, project_id, synced_at.timestamp()))
+
+    def get_validation(self, api_key_hash: str, workspace_id: str) -> datetime | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT validated_at FROM validations WHERE api_key_hash = ? AND workspace_id = ?", (api_key_hash, workspace_id)).fetchone()
+        return datetime.fromtimestamp(row[0], tz=timezone.utc) if row else None
+
+    def set_validation(self, api_key_hash: str, workspace_id: str, validated_at: datetime) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO validations VALUES (?, ?, ?)", (api_key_hash, workspace_id, validated_at.timestamp()))
+
+    def _evict(self) -> None:
+        total_size = self.connection.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM time_entries").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        evicted = []
+        for rowid, size in self.connection.execute("SELECT rowid, LENGTH(payload) FROM time_entries ORDER BY last_used"):
+            if total_size <= self.max_size:
+                break
+            evicted.append((rowid,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM time_entries WHERE rowid = ?", evicted)
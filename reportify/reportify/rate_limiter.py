@@ -0,0 +1,34 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Sliding window limiter shared by all threads that talk to the same API
+
+    A request may go out only while fewer than limit requests were sent within the last period, so no
+    window of that length ever holds more requests than the API allows, not even right after the start.
+
+    Args:
+        limit (float): Maximum number of requests per period
+        period (float): Length of the window in seconds
+
+    """
+    def __init__(self, limit: float, period: float = 1.0) -> None:
+        self.limit = max(1, int(limit))
+        self.period = period
+        self.sent_at = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent_at and now - self.sent_at[0] >= self.period:
+                    self.sent_at.popleft()
+                if len(self.sent_at) < self.limit:
+                    self.sent_at.append(now)
+                    return
+                wait_time = self.period - (now - self.sent_at[0])
+            time.sleep(wait_time)
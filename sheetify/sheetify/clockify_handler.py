@@ -1,44 +1,140 @@
 import click
-import pytz
+import hashlib
 import requests
-from sheetify.config.settings import CLOCKIFY_BASE_URL
-from datetime import datetime, timedelta, timezone
+import threading
+from sheetify.config.settings import (
+    CLOCKIFY_BASE_URL, CLOCKIFY_PAGE_SIZE, CLOCKIFY_MAX_WORKERS, CLOCKIFY_RATE_LIMIT, CLOCKIFY_SYNC_WINDOW_HOURS,
+    CLOCKIFY_VALIDATION_TTL_HOURS, CLOCKIFY_REQUEST_TIMEOUT, REPORT_TIMEZONE, REQUEST_RETRY_MAX_SECONDS
+)
+from sheetify.rate_limiter import RateLimiter
+from sheetify.retry import RETRYABLE_STATUSES, RetryableError, RetryPolicy
+from sheetify.cache import TimeEntriesCache
+from sheetify.slots import UtcOffsets, slot_bounds
+from sheetify.report_model import ReportGrid
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone
 from collections import defaultdict
+from typing import Iterable, Iterator
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+CLOCKIFY_MAX_PAGE_SIZE = 5000
 
 
 class ClockifyAPI:
-    def __init__(self, api_key: str, workspace_id: str) -> None:
+    def __init__(self, api_key: str, workspace_id: str, page_size: int = CLOCKIFY_PAGE_SIZE,
+                 max_workers: int = CLOCKIFY_MAX_WORKERS, rate_limit: float = CLOCKIFY_RATE_LIMIT,
+                 cache: TimeEntriesCache | None = None, sync_window: timedelta = timedelta(hours=CLOCKIFY_SYNC_WINDOW_HOURS),
+                 report_timezone: str = REPORT_TIMEZONE, max_retry_time: float = REQUEST_RETRY_MAX_SECONDS,
+                 validation_ttl: timedelta = timedelta(hours=CLOCKIFY_VALIDATION_TTL_HOURS),
+                 request_timeout: float = CLOCKIFY_REQUEST_TIMEOUT) -> None:
         self.headers = {
             'X-Api-Key': api_key,
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
         }
         self.workspace_id = workspace_id
-        self._validate_clockify_data()
+        self.page_size = max(1, min(page_size, CLOCKIFY_MAX_PAGE_SIZE))
+        self.max_workers = max(1, max_workers)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retry_policy = RetryPolicy(max_retry_time)
+        # Connect and read timeout, a stalled connection fails and is retried instead of blocking the run
+        self.request_timeout = request_timeout
+        self.cache = cache
+        self.sync_window = sync_window
+        self.report_timezone = self._resolve_timezone(report_timezone)
+        self.utc_offsets = UtcOffsets(self.report_timezone)
+        self.session = self._create_session()
+        # The API key and workspace are checked before the first request, not when the client is created
+        self.validation_ttl = validation_ttl
+        self.validation_lock = threading.Lock()
+        self.validated = False
+
+    def _create_session(self) -> requests.Session:
+        # One pooled connection per worker, so concurrent fetches reuse TCP/TLS connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def _resolve_timezone(name: str) -> ZoneInfo:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise click.BadParameter(f'Unknown time zone: {name}.')
 
     def _validate_clockify_data(self) -> None:
-        api_url = 'https://api.clockify.me/api/v1/user'
-        response = requests.get(api_url, headers=self.headers)
+        """
+        Check that the API key exists and has access to the workspace
+
+        A single request to the workspaces of the API key answers both questions. A successful check is kept
+        in the cache for validation_ttl, keyed by a hash of the API key and the workspace, so later runs skip it.
+
+        """
+        api_key_hash = hashlib.sha256(self.headers['X-Api-Key'].encode()).hexdigest()
+        validated_at = self.cache.get_validation(api_key_hash, self.workspace_id) if self.cache else None
+        if validated_at and datetime.now(timezone.utc) - validated_at < self.validation_ttl:
+            return
+
+        response = self.retry_policy.run(lambda: self._send(f"{CLOCKIFY_BASE_URL}/workspaces"))
         if response.status_code != 200:
             raise click.BadParameter('Invalid API key: User does not exist.')
-        
-        id_url = 'https://api.clockify.me/api/v1/workspaces'
-        response = requests.get(id_url, headers=self.headers)
-        if response.status_code != 200:
+        if self.workspace_id not in {workspace['id'] for workspace in response.json()}:
             raise click.BadParameter('Invalid workspace ID: Workspace does not exist.')
 
-    @classmethod
-    def round_time_to_nearest_quarter(cls, dt: datetime, round_up: bool = False) -> datetime:
-        if round_up:
-            dt += timedelta(minutes=15 - dt.minute % 15, seconds=-dt.second, microseconds=-dt.microsecond) # datetime: 1900-01-01 04:45:00+02:00
-        else:
-            dt -= timedelta(minutes=dt.minute % 15, seconds=dt.second, microseconds=dt.microsecond) # datetime: 1900-01-01 04:30:00+02:00
-        return dt
+        if self.cache:
+            self.cache.set_validation(api_key_hash, self.workspace_id, datetime.now(timezone.utc))
+
+    def _get(self, url: str, params: dict = None) -> requests.Response:
+        if not self.validated:
+            with self.validation_lock:
+                if not self.validated:
+                    self._validate_clockify_data()
+                    self.validated = True
+        return self.retry_policy.run(lambda: self._send(url, params))
+
+    def _send(self, url: str, params: dict = None) -> requests.Response:
+        self.rate_limiter.acquire()
+        try:
+            response = self.session.get(url, params=params, timeout=self.request_timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+            raise RetryableError(None) from err
+        if response.status_code in RETRYABLE_STATUSES:
+            raise RetryableError(response.status_code, response.headers.get('Retry-After'))
+        return response
+
+    def _paginate(self, url: str, resource: str, params: dict = None) -> Iterator[dict]:
+        """
+        Iterate over all items of a paginated endpoint, one page at a time
 
-    @classmethod
-    def convert_to_local_time(cls, dt: datetime) -> datetime:
-        return dt.replace(tzinfo=pytz.utc).astimezone(pytz.timezone('Europe/Prague')) # datetime: 1900-01-01 04:31:00+02:00
+        Args:
+            url (str): The endpoint URL
+            resource (str): Name of the fetched resource used in error messages
+            params (dict): Query parameters sent with every page
+
+        Yields:
+            dict: Items of the response pages as they arrive
 
-    def get_workspace_users(self, params: dict=None) -> dict:
+        """
+        page = 1
+        while True:
+            response = self._get(url, params={**(params or {}), 'page': page, 'page-size': self.page_size})
+            items = response.json()
+            if isinstance(items, dict):
+                raise click.BadParameter(f"Error fetching {resource}: {items.get('message', items)}")
+            elif not isinstance(items, list):
+                raise ValueError(f"Unexpected response type: {type(items)}")
+
+            yield from items
+            if len(items) < self.page_size:
+                return
+            page += 1
+
+    def get_workspace_users(self, params: dict=None) -> list[dict]:
         """
         Get all users in a workspace
 
@@ -47,19 +143,17 @@ class ClockifyAPI:
             params (dict): Query parameters -> projectId, memberships
         
         Returns:
-            dict: The response JSON
+            list[dict]: Users from all response pages
 
         """
         url = f"{CLOCKIFY_BASE_URL}/workspaces/{self.workspace_id}/users"
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-
-            return response.json()
+            return list(self._paginate(url, 'users', params=params))
         except requests.exceptions.HTTPError as err:
             print(f"Error fetching users: {err}")
             raise
     
-    def get_all_projects_in_workspace(self, params: dict=None) -> dict:
+    def get_all_projects_in_workspace(self, params: dict=None) -> list[dict]:
         """
         Get all projects in a workspace
 
@@ -68,12 +162,11 @@ class ClockifyAPI:
             params (dict): Query parameters -> name
         
         Returns:
-            dict: The response JSON
+            list[dict]: Projects from all response pages
 
         """
         url = f"{CLOCKIFY_BASE_URL}/workspaces/{self.workspace_id}/projects"
-        response = requests.get(url, headers=self.headers, params=params)
-        return response.json()
+        return list(self._paginate(url, 'projects', params=params))
     
     def initialize_project_data(self, project_name: str) -> dict:
         projects = self.get_all_projects_in_workspace()
@@ -83,70 +176,120 @@ class ClockifyAPI:
         
         raise click.BadParameter(f'Project "{project_name}" does not exist in the workspace.')
     
-    def get_time_entries_for_user(self, user_id: str, params: dict=None) -> dict:
+    def iter_time_entries_for_user(self, user_id: str, params: dict=None) -> Iterator[dict]:
         """
-        Get time entries for a user
+        Iterate over all time entries of a user, page by page
 
         Args:
             user_id (str): The user ID
             params (dict): Query parameters -> start, end, description, project
-        
-        Returns:
-            dict: The response JSON
+
+        Yields:
+            dict: Time entries as the pages arrive
 
         """
         url = f"{CLOCKIFY_BASE_URL}/workspaces/{self.workspace_id}/user/{user_id}/time-entries"
-        response = requests.get(url, headers=self.headers, params=params)
-        return response.json()
-    
-    def fetch_time_entries(self, users_id, project_id: str, start_of_day: datetime, end_of_day: datetime) -> dict:
-        time_entries = defaultdict(lambda: defaultdict(str))
-
-        for user_id in users_id:
-            time_entries_by_user = self.get_time_entries_for_user(user_id, params={
-                                                                  'project': project_id, 'start': start_of_day.isoformat(), 'end': end_of_day.isoformat()})
-            if isinstance(time_entries_by_user, dict):
-                if 'message' in time_entries_by_user:
-                    raise click.BadParameter(
-                        f"Error fetching time entries: {time_entries_by_user['message']}")
-
-            elif isinstance(time_entries_by_user, list):
-                for time_entry in time_entries_by_user:
-                    start_of_work = self.convert_to_local_time(datetime.fromisoformat(
-                        time_entry['timeInterval']['start']).replace(tzinfo=timezone.utc))  # datetime: 1900-01-01 04:31:00+02:00
-                    end_of_work = self.convert_to_local_time(datetime.now(timezone.utc).replace(tzinfo=timezone.utc)
-                                                             if time_entry['timeInterval']['end'] is None
-                                                             else datetime.fromisoformat(time_entry['timeInterval']['end']).replace(tzinfo=timezone.utc))  # datetime: 1900-01-01 04:41:00+02:00
-
-                    start_of_work = self.round_time_to_nearest_quarter(
-                        start_of_work, round_up=True)  # datetime: 1900-01-01 04:30:00+02:00
-                    if end_of_work.minute % 15 != 0:
-                        end_of_work = self.round_time_to_nearest_quarter(
-                            end_of_work, round_up=True)  # datetime: 1900-01-01 04:45:00+02:00
-
-                    while start_of_work <= end_of_work:
-                        time_slot = start_of_work.strftime(
-                            '%H:%M')  # str: 04:30
-                        time_entries[user_id][time_slot] = time_entry['description']
-                        # datetime: 1900-01-01 04:45:00+02:00
-                        start_of_work += timedelta(minutes=15)
-            else:
-                raise ValueError(
-                    f"Unexpected response type: {type(time_entries_by_user)}")
-
-        return time_entries
-
-    def get_users_in_work(self, all_users: dict, project_id: str, first_day: datetime, last_day: datetime) -> dict:
-        users_in_work = {}
-
-        for user in all_users:
-            time_entries = self.get_time_entries_for_user(user['id'], params={
+        yield from self._paginate(url, 'time entries', params=params)
+
+    def get_time_entries_for_period(self, user_id: str, project_id: str, first_day: datetime, last_day: datetime,
+                                    revalidate_after: datetime | None = None) -> Iterable[dict]:
+        """
+        Get all time entries of a user in a project that start within the period
+
+        Closed UTC days are served from the cache when one is configured, only the missing days are
+        requested from Clockify in a single range query.
+
+        Args:
+            user_id (str): The user ID
+            project_id (str): The project ID
+            first_day (datetime): Start of the period
+            last_day (datetime): End of the period
+            revalidate_after (datetime): Cached days ending after this moment are downloaded again
+
+        Returns:
+            Iterable[dict]: Time entries of the user
+
+        """
+        if self.cache is None:
+            return self.iter_time_entries_for_user(user_id, params={
                 'project': project_id,
-                'start': first_day.isoformat(),
-                'end': last_day.isoformat()
-            })
+                'start': first_day.astimezone(timezone.utc).isoformat(),
+                'end': last_day.astimezone(timezone.utc).isoformat()})
 
-            if time_entries:
-                users_in_work[user['name']] = user['id']
-        
-        return users_in_work
\ No newline at end of file
+        first_utc_day = first_day.astimezone(timezone.utc).date()
+        last_utc_day = last_day.astimezone(timezone.utc).date()
+        days = [first_utc_day + timedelta(days=offset) for offset in range((last_utc_day - first_utc_day).days + 1)]
+
+        time_entries_by_day = self.cache.get_days(self.workspace_id, user_id, project_id, first_utc_day, last_utc_day)
+        if revalidate_after is not None:
+            time_entries_by_day = {day: time_entries for day, time_entries in time_entries_by_day.items()
+                                   if datetime.combine(day + timedelta(days=1), time.min, tzinfo=timezone.utc) <= revalidate_after}
+        missing_days = [day for day in days if day not in time_entries_by_day]
+
+        if missing_days:
+            # Whole UTC days are fetched so that every fetched day can be stored as a complete cache entry
+            fetch_start = datetime.combine(missing_days[0], time.min, tzinfo=timezone.utc)
+            fetch_end = datetime.combine(missing_days[-1] + timedelta(days=1), time.min, tzinfo=timezone.utc)
+            fetched_by_day = defaultdict(list)
+            for time_entry in self.iter_time_entries_for_user(user_id, params={
+                    'project': project_id, 'start': fetch_start.isoformat(), 'end': fetch_end.isoformat()}):
+                fetched_by_day[datetime.fromisoformat(time_entry['timeInterval']['start']).replace(tzinfo=timezone.utc).date()].append(time_entry)
+
+            now = datetime.now(timezone.utc)
+            closed_days = {}
+            for day in missing_days:
+                time_entries_by_day[day] = fetched_by_day.get(day, [])
+                day_end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=timezone.utc)
+                if day_end <= now and all(time_entry['timeInterval']['end'] for time_entry in time_entries_by_day[day]):
+                    closed_days[day] = time_entries_by_day[day]
+            self.cache.put_days(self.workspace_id, user_id, project_id, closed_days)
+
+        return [time_entry for day in days for time_entry in time_entries_by_day[day]
+                if first_day <= datetime.fromisoformat(time_entry['timeInterval']['start']).replace(tzinfo=timezone.utc) <= last_day]
+
+    def fetch_time_entries_for_user(self, user_id: str, project_id: str, first_day: datetime, last_day: datetime,
+                                    revalidate_after: datetime | None = None) -> list[tuple[int, int, str]]:
+        # (first slot, last slot, description) of every entry, slots are counted from the epoch in local time
+        intervals = []
+        now = datetime.now(timezone.utc)
+
+        for time_entry in self.get_time_entries_for_period(user_id, project_id, first_day, last_day, revalidate_after):
+            start_of_work = datetime.fromisoformat(time_entry['timeInterval']['start']).replace(tzinfo=timezone.utc)
+            end_of_work = now if time_entry['timeInterval']['end'] is None else datetime.fromisoformat(time_entry['timeInterval']['end']).replace(tzinfo=timezone.utc)
+
+            # Whole interval is shifted by the offset at its start, so slots are plain integer arithmetic
+            start_seconds, end_seconds = int(start_of_work.timestamp()), int(end_of_work.timestamp())
+            utc_offset = self.utc_offsets.offset(start_seconds)
+            first_slot, last_slot = slot_bounds(start_seconds + utc_offset, end_seconds + utc_offset)
+            intervals.append((first_slot, last_slot, time_entry['description']))
+
+        return intervals
+
+    def fetch_time_entries(self, all_users: list[dict], project_id: str, first_day: datetime, last_day: datetime, since_last_run: bool = False) -> ReportGrid:
+        report = ReportGrid(first_day.date(), (last_day.date() - first_day.date()).days)
+        synced_at = datetime.now(timezone.utc)
+        revalidate_after = None
+        self.utc_offsets.precompute(first_day, last_day)
+
+        # Without the cache every day is downloaded anyway, so there is nothing to re-check
+        since_last_run = since_last_run and self.cache is not None
+        if since_last_run:
+            # Entries edited after the last run can only belong to recent days, so the cached days closed within
+            # the sync window before the high-water mark are downloaded again; the first run uses the current time
+            last_sync = self.cache.get_last_sync(self.workspace_id, project_id)
+            revalidate_after = (last_sync if last_sync else synced_at) - self.sync_window
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            intervals_by_user = executor.map(
+                lambda user: self.fetch_time_entries_for_user(user['id'], project_id, first_day, last_day, revalidate_after), all_users)
+
+            # executor.map keeps the order of all_users, so the report columns stay deterministic;
+            # users without entries in the period are left out of the report
+            for user, intervals in zip(all_users, intervals_by_user):
+                if intervals:
+                    report.add_user(user['id'], user['name'], intervals)
+
+        if since_last_run:
+            self.cache.set_last_sync(self.workspace_id, project_id, synced_at)
+
+        return report
@@ -33,6 +33,17 @@ WORKSPACE_NAME = os.getenv('WORKSPACE_NAME', None)
 CLOCKIFY_API_KEY = os.getenv('CLOCKIFY_API_KEY')
 CLOCKIFY_BASE_URL = os.getenv('CLOCKIFY_BASE_URL', 'https://api.clockify.me/api/v1')
 CLOCKIFY_WORKSPACE_ID = os.getenv('CLOCKIFY_WORKSPACE_ID')
+CLOCKIFY_PAGE_SIZE = int(os.getenv('CLOCKIFY_PAGE_SIZE', 1000))
+CLOCKIFY_MAX_WORKERS = int(os.getenv('CLOCKIFY_MAX_WORKERS', 8))
+CLOCKIFY_RATE_LIMIT = float(os.getenv('CLOCKIFY_RATE_LIMIT', 50))
+CLOCKIFY_CACHE_PATH = os.getenv('CLOCKIFY_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'sheetify', 'time_entries.sqlite3'))
+CLOCKIFY_CACHE_MAX_SIZE_MB = float(os.getenv('CLOCKIFY_CACHE_MAX_SIZE_MB', 256))
+CLOCKIFY_SYNC_WINDOW_HOURS = float(os.getenv('CLOCKIFY_SYNC_WINDOW_HOURS', 48))
+CLOCKIFY_VALIDATION_TTL_HOURS = float(os.getenv('CLOCKIFY_VALIDATION_TTL_HOURS', 24))
+CLOCKIFY_REQUEST_TIMEOUT = float(os.getenv('CLOCKIFY_REQUEST_TIMEOUT', 30))
+REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'Europe/Prague')
+REQUEST_RETRY_MAX_SECONDS = float(os.getenv('REQUEST_RETRY_MAX_SECONDS', 300))
 GOOGLE_SHEETS_CREDENTIALS_FILE = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
 GOOGLE_OAUTH_TOKEN_FILE = os.getenv('GOOGLE_OAUTH_TOKEN_FILE')
-SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
\ No newline at end of file
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+GOOGLE_SHEETS_RATE_LIMIT = float(os.getenv('GOOGLE_SHEETS_RATE_LIMIT', 60))
\ No newline at end of file
@@ -1,11 +1,12 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from tqdm import tqdm
 import json
 import os
 import click
 import re
 from sheetify.clockify_handler import ClockifyAPI
-from sheetify.config.settings import SPREADSHEET_ID, CLOCKIFY_API_KEY, CLOCKIFY_WORKSPACE_ID, GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_OAUTH_TOKEN_FILE, WORKSPACE_NAME
+from sheetify.cache import TimeEntriesCache
+from sheetify.config.settings import SPREADSHEET_ID, CLOCKIFY_API_KEY, CLOCKIFY_WORKSPACE_ID, CLOCKIFY_CACHE_PATH, CLOCKIFY_CACHE_MAX_SIZE_MB, REPORT_TIMEZONE, GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_OAUTH_TOKEN_FILE, WORKSPACE_NAME
 from sheetify.sheet_handler import GoogleSheetAPI
 
 
@@ -43,16 +44,25 @@ def click_validate_auth_data(api_key: str, workspace_id: str, google_creds: str,
 @click.option('--workspace-id', prompt=False, help='Clockify workspace ID')
 @click.option('--google-creds', prompt=False, help='Path to Google Sheets credentials JSON file')
 @click.option('--google-sheet-id', prompt=False, help='Google Sheet ID to append data to')
-def main(project: str, start: datetime, stop: datetime, api_key: str | None, workspace_id: str | None, google_creds: str | None, google_sheet_id: str | None):
+@click.option('--no-cache', is_flag=True, default=False, help='Do not read or write the local time entries cache')
+@click.option('--refresh', is_flag=True, default=False, help='Ignore cached time entries and download them again')
+@click.option('--since-last-run', is_flag=True, default=False, help='Download again the cached days closed shortly before the last run of this project, to pick up edited entries')
+@click.option('--timezone', 'report_timezone', prompt=False, help='Time zone of the report slots, e.g. Europe/Prague')
+def main(project: str, start: datetime, stop: datetime, api_key: str | None, workspace_id: str | None, google_creds: str | None, google_sheet_id: str | None, no_cache: bool, refresh: bool, since_last_run: bool, report_timezone: str | None):
     click_validate_dates(start, stop)
     click_validate_auth_data(api_key, workspace_id, google_creds, google_sheet_id)
+    if since_last_run and no_cache:
+        raise click.BadParameter('--since-last-run needs the time entries cache and cannot be combined with --no-cache.')
     total_days = float((stop - start).days) + 1
     start, stop = str(start.date()), str(stop.date())  # str: 1900-01-01
     google_sheet_id = google_sheet_id if google_sheet_id else SPREADSHEET_ID
     print("")
 
+    cache = None if no_cache else TimeEntriesCache(CLOCKIFY_CACHE_PATH, CLOCKIFY_CACHE_MAX_SIZE_MB, refresh=refresh)
     clockify_api = ClockifyAPI(api_key=CLOCKIFY_API_KEY if not api_key else api_key,
-                               workspace_id=CLOCKIFY_WORKSPACE_ID if not workspace_id else workspace_id)
+                               workspace_id=CLOCKIFY_WORKSPACE_ID if not workspace_id else workspace_id,
+                               cache=cache,
+                               report_timezone=report_timezone if report_timezone else REPORT_TIMEZONE)
     sheet_api = GoogleSheetAPI(spreadsheet_id=google_sheet_id,
                                credentials_path=GOOGLE_SHEETS_CREDENTIALS_FILE if not google_creds else google_creds,
                                token_path=GOOGLE_OAUTH_TOKEN_FILE)
@@ -63,59 +73,43 @@ def main(project: str, start: datetime, stop: datetime, api_key: str | None, wor
         print(e)
         exit(0)
 
-    sheet_name = f"{project_data['name']} [{start} / {stop}]"
-    sheet_id = sheet_api.prepare_worksheet(sheet_name)
-
     all_users = clockify_api.get_workspace_users()
 
-    first_day = datetime.strptime(start, '%Y-%m-%d').replace(hour=0, minute=15, second=0, microsecond=0, tzinfo=timezone.utc)
-    last_day = (datetime.strptime(stop, '%Y-%m-%d') + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    first_day = datetime.strptime(start, '%Y-%m-%d').replace(tzinfo=clockify_api.report_timezone)
+    last_day = (datetime.strptime(stop, '%Y-%m-%d') + timedelta(days=1)).replace(tzinfo=clockify_api.report_timezone)
 
-    users_in_work = clockify_api.get_users_in_work(all_users, project_data['id'], first_day, last_day)
-    if not users_in_work:
+    report = clockify_api.fetch_time_entries(all_users, project_data['id'], first_day, last_day, since_last_run)
+    if not report.num_users:
         print("No users found in the project for the given period. Exiting without creating a new file.")
         print("")
         exit(0)
 
-    active_users_name = list(users_in_work.keys())
-    active_users_id = list(users_in_work.values())
+    sheet_name = f"{project_data['name']} [{start} / {stop}]"
+    sheet_id = sheet_api.prepare_worksheet(sheet_name, report.num_days, report.num_users)
 
     progress_bar = tqdm(total=int(total_days), desc='Processing', unit='day', leave=True, colour='#3FDCEE',
                         ascii=True, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}, {rate_fmt}{postfix}]')
 
     if WORKSPACE_NAME is None:
-        sheet_api._safety_append_rows([f"Report for Period from {start} to {stop}"] + [""], row=True)
+        sheet_api.write_rows([[f"Report for Period from {start} to {stop}"] + [""]], row=1)
     else:
-        sheet_api._safety_append_rows([f"{WORKSPACE_NAME} Report for Period from {start} to {stop}"] + [""], row=True)
+        sheet_api.write_rows([[f"{WORKSPACE_NAME} Report for Period from {start} to {stop}"] + [""]], row=1)
     
-    header_len = len(active_users_id) + 1 if len(active_users_id) > 4 else 5
+    header_len = report.num_users + 1 if report.num_users > 4 else 5
     sheet_api.header_formating(0, 0, header_len)
 
-    sheet_api._safety_append_rows(["·"], row=True)
-    current_date = start
+    sheet_api.write_rows([["·"]], row=2)
     row_index = 4
 
-    while current_date <= stop:
-        day_begin = datetime.strptime(current_date, '%Y-%m-%d').replace(hour=0, minute=15, second=0, microsecond=0, tzinfo=timezone.utc)  # datetime: 1900-01-01 00:15:00+02:00
-        day_finish = (day_begin + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)  # datetime: 1900-01-02 00:00:00+02:00
-        time_entries = clockify_api.fetch_time_entries(active_users_id, project_data['id'], day_begin, day_finish)
-
-        header_row = [current_date] + active_users_name
-        sheet_data_to_send = [header_row]
-
-        for time_slot in range(0, 96):
-            time_period = (day_begin + timedelta(minutes=15 * time_slot)).strftime('%H:%M')  # str: 04:30
-            row = [time_period] + [time_entries[user_id].get(time_period, '') for user_id in active_users_id]
-            sheet_data_to_send.append(row)
-
-        sheet_api.append_table_to_sheet(sheet_data_to_send, current_date, len(users_in_work), row_index)
+    for day_index in range(report.num_days):
+        sheet_api.append_table_to_sheet(report, day_index, row_index)
 
-        sheet_api._safety_append_rows(["·"], row=True)
+        sheet_api.write_rows([["·"]], row=row_index + 97)
         row_index += 99
-        current_date = (day_begin + timedelta(days=1)).strftime('%Y-%m-%d')  # str: 1900-01-02
         progress_bar.update(1)
 
-    sheet_api.append_all_totals(int(total_days), users_in_work, start, stop)
+    sheet_api.append_all_totals(int(total_days), report.users_name, start, stop)
+    sheet_api.flush()
     progress_bar.close()
 
     print("")
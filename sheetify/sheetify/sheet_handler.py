@@ -1,29 +1,50 @@
 import os
 import json
-import gspread
-import time
-from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from datetime import datetime
-from openpyxl.utils import get_column_letter
-import gspread
+from sheetify.config.settings import GOOGLE_SHEETS_RATE_LIMIT, REQUEST_RETRY_MAX_SECONDS
+from sheetify.rate_limiter import RateLimiter
+from sheetify.retry import RETRYABLE_STATUSES, RetryableError, RetryPolicy
+from sheetify.report_model import ReportGrid
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar('T')
+
+# Limits per flushed request, far below the 10 MB payload limit of the Sheets API
+SHEETS_MAX_CELLS_PER_REQUEST = 50_000
+SHEETS_MAX_REQUESTS_PER_BATCH = 500
+
+
+def get_column_letter(col_index: int) -> str:
+    # 1-based column index to its A1 letters, e.g. 28 -> AB
+    letters = ''
+    while col_index:
+        col_index, remainder = divmod(col_index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
 
 
 class GoogleSheetAPI:
-    def __init__(self, spreadsheet_id: str, credentials_path: str, token_path: str) -> None:
+    def __init__(self, spreadsheet_id: str, credentials_path: str, token_path: str,
+                 rate_limit: float = GOOGLE_SHEETS_RATE_LIMIT, max_retry_time: float = REQUEST_RETRY_MAX_SECONDS) -> None:
         self.credentials_path = credentials_path
         self.token_path = token_path
         self.spreadsheet_id = spreadsheet_id
-        self.gc = None
         self.credentials = None
         self.service = None
-        self.worksheet = None
+        self.spreadsheets_resource = None
+        self.sheet_title = None
         self.sheet_id = None
+        self.pending_values = []
+        self.pending_requests = []
+        # Sheets quotas are counted per minute, so at most rate_limit requests go out in any 60 seconds
+        self.quota = RateLimiter(rate_limit, period=60)
+        self.retry_policy = RetryPolicy(max_retry_time)
 
     def _authorize(self):
+        # The Google client libraries take hundreds of milliseconds to import, so only Sheets runs load them
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
         scopes = ['https://www.googleapis.com/auth/spreadsheets']
 
         try:
@@ -43,59 +64,182 @@ class GoogleSheetAPI:
             with open(self.token_path, 'w') as token:
                 token.write(self.credentials.to_json())
 
-        self.gc = gspread.authorize(self.credentials)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+    def _build_service(self):
+        from googleapiclient.discovery import build
+
+        # The discovery document bundled with googleapiclient is used, so building the client needs no request
+        return build('sheets', 'v4', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+
+    def _spreadsheets(self):
+        """
+        Spreadsheets resource of the Sheets API client, built on first use and then reused
+
+        Every spreadsheets() call generates the resource methods from the discovery document again, which takes
+        tens of milliseconds. Batch runs write all of their reports through one GoogleSheetAPI, so they authorize
+        and build the client only once.
+
+        """
+        if not self.spreadsheets_resource:
+            if not self.service:
+                if not self.credentials:
+                    self._authorize()
+                self.service = self._build_service()
+            self.spreadsheets_resource = self.service.spreadsheets()
+        return self.spreadsheets_resource
+
+    def _execute(self, send: Callable[[], T]) -> T:
+        """
+        Send one Sheets API call within the request quota, retrying transient failures
+
+        Args:
+            send (Callable): Performs the call, e.g. the execute method of a googleapiclient request
+
+        Returns:
+            The result of the call
+
+        """
+        from googleapiclient.errors import HttpError
+        from httplib2 import HttpLib2Error
 
-    def _safety_append_rows(self, data: list[list[str]], value_input_option: str = None, row: bool = False) -> None:
-        while True:
+        def attempt() -> T:
+            self.quota.acquire()
             try:
-                if row:
-                    self.worksheet.append_row(data, value_input_option=value_input_option) if value_input_option else self.worksheet.append_row(data)
-                else:
-                    self.worksheet.append_rows(data, value_input_option=value_input_option) if value_input_option else self.worksheet.append_rows(data)
-                break
-            except gspread.exceptions.APIError as e:
-                print("Data write is temporarily paused due to exceeding API request limits. The system will resume operation after a short delay...")
-                time.sleep(60)
-
-    def open_sheet(self) -> gspread.Spreadsheet:
-        if not self.gc:
-            self._authorize()
-        return self.gc.open_by_key(self.spreadsheet_id)
-
-    def prepare_worksheet(self, sheet_name: str) -> tuple[gspread.Worksheet, int]:
-        try:
-            self.worksheet = self.open_sheet().worksheet(sheet_name)
-            sheet_metadata = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-            sheets = sheet_metadata.get('sheets', [])
-            self.sheet_id = next(
-                sheet['properties']['sheetId']
-                for sheet in sheets
-                if sheet['properties']['title'] == sheet_name
-            )
+                return send()
+            except HttpError as err:
+                status, retry_after = err.resp.status, err.resp.get('retry-after')
+                if status not in RETRYABLE_STATUSES:
+                    raise
+                raise RetryableError(status, retry_after) from err
+            except (HttpLib2Error, OSError) as err:
+                # Socket timeouts, dropped connections and other transport failures never reach the API
+                raise RetryableError(None) from err
+
+        return self.retry_policy.run(attempt)
+
+    def write_rows(self, data: Iterable[list[str]], row: int, value_input_option: str = 'RAW') -> None:
+        """
+        Buffer rows for the explicit range starting at column A of the given row, they are written by flush()
+
+        Rows can be buffered in any order, adjacent blocks are merged into a single range.
+
+        Args:
+            data (Iterable[list[str]]): Rows to write, consumed once
+            row (int): 1-based row of the first written row
+            value_input_option (str): RAW or USER_ENTERED
+
+        """
+        last = self.pending_values[-1] if self.pending_values else None
+        if last and last['value_input_option'] == value_input_option and last['row'] + len(last['values']) == row:
+            last['values'].extend(data)
+        else:
+            self.pending_values.append({'row': row, 'values': list(data), 'value_input_option': value_input_option})
+
+    def _queue_requests(self, requests: list[dict]) -> None:
+        self.pending_requests.extend(requests)
+
+    def flush(self) -> None:
+        """
+        Write all buffered values and formatting requests in as few API calls as possible
+
+        Values go out in values.batchUpdate calls of at most SHEETS_MAX_CELLS_PER_REQUEST cells, one per
+        value input option, formatting in spreadsheets.batchUpdate calls of SHEETS_MAX_REQUESTS_PER_BATCH requests.
+
+        """
+        from googleapiclient.errors import HttpError
+
+        title = self.sheet_title.replace("'", "''")
+        for value_input_option in ('RAW', 'USER_ENTERED'):
+            data, cells = [], 0
+            for block in self.pending_values:
+                if block['value_input_option'] != value_input_option:
+                    continue
+                block_cells = sum(len(row) for row in block['values'])
+                if data and cells + block_cells > SHEETS_MAX_CELLS_PER_REQUEST:
+                    self._batch_update_values(data, value_input_option)
+                    data, cells = [], 0
+                data.append({'range': f"'{title}'!A{block['row']}", 'values': block['values']})
+                cells += block_cells
+            if data:
+                self._batch_update_values(data, value_input_option)
+        self.pending_values = []
+
+        for start in range(0, len(self.pending_requests), SHEETS_MAX_REQUESTS_PER_BATCH):
+            body = {'requests': self.pending_requests[start:start + SHEETS_MAX_REQUESTS_PER_BATCH]}
+            try:
+                self._execute(self._spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute)
+            except HttpError as err:
+                print(f'An error occurred: {err}')
+        self.pending_requests = []
+
+    def _batch_update_values(self, data: list[dict], value_input_option: str) -> None:
+        body = {'valueInputOption': value_input_option, 'data': data}
+        self._execute(self._spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body).execute)
+
+    def prepare_worksheet(self, sheet_name: str, num_days: int, num_users: int) -> int:
+        """
+        Create the report worksheet at its final size, exit if it already exists
+
+        Only the sheet properties are fetched to look for an existing sheet, then the grid, frozen title
+        row and column widths are set by a single batchUpdate, so the sheet never has to grow while the
+        report is written.
+
+        Args:
+            sheet_name (str): Title of the new worksheet
+            num_days (int): Number of days in the report
+            num_users (int): Number of users in the report
+
+        Returns:
+            int: The sheetId of the new worksheet
+
+        """
+        from googleapiclient.errors import HttpError
+
+        sheet_metadata = self._execute(self._spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id, fields='sheets.properties').execute)
+        sheets = [sheet['properties'] for sheet in sheet_metadata.get('sheets', [])]
+        existing_sheet = next((sheet for sheet in sheets if sheet['title'] == sheet_name), None)
+        if existing_sheet:
             print(f"Sheet {sheet_name} already exists.")
-            print(f"Open the sheet at https://docs.google.com/spreadsheets/d/{self.spreadsheet_id}/edit#gid={self.sheet_id}")
+            print(f"Open the sheet at https://docs.google.com/spreadsheets/d/{self.spreadsheet_id}/edit#gid={existing_sheet['sheetId']}")
             exit(0)
-        except gspread.exceptions.WorksheetNotFound:
-            try:
-                self.open_sheet().add_worksheet(title=sheet_name, rows="1000", cols="26")
-                self.worksheet = self.open_sheet().worksheet(sheet_name)
-                sheet_metadata = self.service.spreadsheets().get(
-                    spreadsheetId=self.spreadsheet_id).execute()
-                sheets = sheet_metadata.get('sheets', [])
-                self.sheet_id = next(
-                    sheet['properties']['sheetId']
-                    for sheet in sheets
-                    if sheet['properties']['title'] == sheet_name
-                )
-                self.set_column_widths(start_col=0, end_col=26, width=185)
-                return self.sheet_id
-            except gspread.exceptions.APIError as e:
-                print(f"Error creating sheet {sheet_name}: {e}")
-                exit(1)
-    
-    def append_table_to_sheet(self, data: list[list[datetime | str]], current_date: str, found_users: int, start_row: int, num_rows: int = 96) -> None:
-        self._safety_append_rows(data, value_input_option='USER_ENTERED')
+
+        # The new sheetId is chosen up front, so the column widths can go into the same batchUpdate
+        self.sheet_id = max((sheet['sheetId'] for sheet in sheets), default=0) + 1
+        self.sheet_title = sheet_name
+
+        # Title and spacer row, 99 rows per day, header and total row of the all total table
+        num_rows = 2 + num_days * 99 + 2
+        num_cols = max(num_users + 1, 5)
+        requests = [
+            {
+                "addSheet": {
+                    "properties": {
+                        "sheetId": self.sheet_id,
+                        "title": sheet_name,
+                        "gridProperties": {
+                            "rowCount": num_rows,
+                            "columnCount": num_cols,
+                            "frozenRowCount": 1,
+                            "frozenColumnCount": 1
+                        }
+                    }
+                }
+            },
+            self._column_widths_request(start_col=0, end_col=num_cols, width=185)
+        ]
+        try:
+            response = self._execute(self._spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id, body={'requests': requests}).execute)
+        except HttpError as e:
+            print(f"Error creating sheet {sheet_name}: {e}")
+            exit(1)
+
+        self.sheet_id = response['replies'][0]['addSheet']['properties']['sheetId']
+        return self.sheet_id
+
+    def append_table_to_sheet(self, report: ReportGrid, day_index: int, start_row: int, num_rows: int = 96) -> None:
+        found_users = report.num_users
+        self.write_rows(report.day_rows(day_index), start_row - 1, value_input_option='USER_ENTERED')
 
         total_formula_row = []
         for col_index in range(2, found_users + 2):
@@ -105,9 +249,9 @@ class GoogleSheetAPI:
             formatted_time_formula = f"=TEXT(INT({total_minutes} / 60), \"0\") & \":\" & TEXT(MOD({total_minutes}, 60), \"00\")"
             total_formula_row.append(formatted_time_formula)
 
-        total_row = [[f'TOTAL [{current_date}]'] + total_formula_row]
+        total_row = [[f'TOTAL [{report.day(day_index)}]'] + total_formula_row]
 
-        self._safety_append_rows(total_row, value_input_option='USER_ENTERED')
+        self.write_rows(total_row, start_row + num_rows, value_input_option='USER_ENTERED')
 
         start_border_row = start_row - 2  # 2 rows before the header row
         end_border_row = start_row + num_rows # 96 rows after the header row
@@ -115,13 +259,13 @@ class GoogleSheetAPI:
         last_column_letter = found_users + 1 # first column is the date
         self.table_formating(start_row=start_border_row, end_row=end_border_row, start_col=first_column_letter, end_col=last_column_letter)
 
-    def append_all_totals(self, num_days: int, users_in_work: dict, start_date: str, stop_date: str) -> None:
+    def append_all_totals(self, num_days: int, users_name: list[str], start_date: str, stop_date: str) -> None:
         total_row_start = 3
         total_row_end = num_days * 99 + 1
 
         all_total_formula_row = []
 
-        for col_index in range(2, len(users_in_work) + 2):
+        for col_index in range(2, len(users_name) + 2):
             column_letter = get_column_letter(col_index)
 
             all_total_minutes = f"SUM(ArrayFormula(VALUE(SPLIT(FILTER({column_letter}{total_row_start}:{column_letter}{total_row_end}, REGEXMATCH(A{total_row_start}:A{total_row_end}, \"TOTAL*\")), \":\")) * {{60, 1}}))"
@@ -129,42 +273,31 @@ class GoogleSheetAPI:
 
             all_total_formula_row.append(formatted_time_formula)
 
-        header_row = ['ALL TOTAL'] + list(users_in_work.keys())
+        header_row = ['ALL TOTAL'] + users_name
         all_total_row = [f'{start_date} / {stop_date}'] + all_total_formula_row
-        self._safety_append_rows([header_row, all_total_row], value_input_option='USER_ENTERED')
+        self.write_rows([header_row, all_total_row], total_row_end + 2, value_input_option='USER_ENTERED')
 
         start_border_row = total_row_end + 1 # 1 row after the last total row
         end_border_row = start_border_row + 2 # 2 rows after the last total row
         first_column_letter = 0
-        last_column_letter = len(users_in_work) + 1 # first column is the date
+        last_column_letter = len(users_name) + 1 # first column is the date
         self.total_formating(start_row=start_border_row, end_row=end_border_row, start_col=first_column_letter, end_col=last_column_letter)
 
-    def set_column_widths(self, start_col: int, end_col: int, width: int) -> None:
-        requests = [
-            {
-                "updateDimensionProperties": {
-                    "range": {
-                        "sheetId": self.sheet_id,
-                        "dimension": "COLUMNS",
-                        "startIndex": start_col,
-                        "endIndex": end_col
-                    },
-                    "properties": {
-                        "pixelSize": width
-                    },
-                    "fields": "pixelSize"
-                }
+    def _column_widths_request(self, start_col: int, end_col: int, width: int) -> dict:
+        return {
+            "updateDimensionProperties": {
+                "range": {
+                    "sheetId": self.sheet_id,
+                    "dimension": "COLUMNS",
+                    "startIndex": start_col,
+                    "endIndex": end_col
+                },
+                "properties": {
+                    "pixelSize": width
+                },
+                "fields": "pixelSize"
             }
-        ]
-        body = {'requests': requests}
-
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body=body
-            ).execute()
-        except HttpError as err:
-            print(f'An error occurred: {err}')
+        }
 
     def header_formating(self, start_row: int, start_col: int, end_col: int) -> None:
         red_color = self.hex_to_rgb("#AC3A4D")
@@ -197,15 +330,7 @@ class GoogleSheetAPI:
             }
         }
         ]
-        body = {'requests': requests}
-
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body=body
-            ).execute()
-        except HttpError as err:
-            print(f'An error occurred: {err}')
+        self._queue_requests(requests)
         
     def table_formating(self, start_row: int, end_row: int, start_col: int, end_col: int) -> None:
         green_color = self.hex_to_rgb("#006100")
@@ -336,15 +461,7 @@ class GoogleSheetAPI:
             }
         }
         ]
-        body = {'requests': requests}
-
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body=body
-            ).execute()
-        except HttpError as err:
-            print(f'An error occurred: {err}')
+        self._queue_requests(requests)
 
     def total_formating(self, start_row: int, end_row: int, start_col: int, end_col: int) -> None:
         red_color = self.hex_to_rgb("#AC3A4D")
@@ -429,15 +546,7 @@ class GoogleSheetAPI:
             }
         }
         ]
-        body = {'requests': requests}
-
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body=body
-            ).execute()
-        except HttpError as err:
-            print(f'An error occurred: {err}')
+        self._queue_requests(requests)
 
     def hex_to_rgb(self, hex_color: str) -> dict:
         hex_color = hex_color.lstrip('#')
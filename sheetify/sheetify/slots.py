@@ -0,0 +1,77 @@
+from datetime import date, datetime, tzinfo
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SLOT_SECONDS = 15 * 60
+SLOT_MINUTES = SLOT_SECONDS // 60
+SLOTS_PER_DAY = 96
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# A day's table runs from 00:15 to 00:00 of the next day, labels are formatted once for all reports
+TIME_SLOT_LABELS = [f"{minutes // 60 % 24:02d}:{minutes % 60:02d}" for minutes in range(15, 24 * 60 + 1, 15)]
+
+
+def slot_bounds(start: int, end: int) -> tuple[int, int]:
+    """
+    Map a work interval to the first and last 15-minute slot it occupies
+
+    The start is rounded up to the next quarter, the end is rounded up unless it already lies on a quarter.
+
+    Args:
+        start (int): Local start of the interval in seconds since the epoch
+        end (int): Local end of the interval in seconds since the epoch
+
+    Returns:
+        tuple[int, int]: Inclusive slot indices counted from the epoch
+
+    """
+    first_slot = start // SLOT_SECONDS + 1
+    last_slot = end // SLOT_SECONDS + (1 if end // 60 % 15 else 0)
+    return first_slot, last_slot
+
+
+class UtcOffsets:
+    """
+    UTC offsets of the report time zone, resolved once per UTC day
+
+    A day with a DST transition keeps the exact transition instant, so converting a timestamp afterwards is
+    an integer comparison instead of a time zone lookup.
+
+    Args:
+        zone (tzinfo): The report time zone
+
+    """
+    def __init__(self, zone: tzinfo) -> None:
+        self.zone = zone
+        self._days = {}
+
+    def precompute(self, first_day: datetime, last_day: datetime) -> None:
+        for day in range(int(first_day.timestamp()) // SECONDS_PER_DAY, int(last_day.timestamp()) // SECONDS_PER_DAY + 1):
+            self._resolve_day(day)
+
+    def offset(self, utc_seconds: int) -> int:
+        day = utc_seconds // SECONDS_PER_DAY
+        offset_before, transition, offset_after = self._days.get(day) or self._resolve_day(day)
+        return offset_before if utc_seconds < transition else offset_after
+
+    def _utc_offset(self, utc_seconds: int) -> int:
+        return int(datetime.fromtimestamp(utc_seconds, self.zone).utcoffset().total_seconds())
+
+    def _resolve_day(self, day: int) -> tuple[int, int, int]:
+        day_start = day * SECONDS_PER_DAY
+        day_end = day_start + SECONDS_PER_DAY
+        offset_before, offset_after = self._utc_offset(day_start), self._utc_offset(day_end)
+
+        transition = day_end
+        if offset_before != offset_after:
+            # Binary search for the first second with the new offset
+            low, high = day_start, day_end
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self._utc_offset(middle) == offset_before:
+                    low = middle
+                else:
+                    high = middle
+            transition = high
+
+        self._days[day] = (offset_before, transition, offset_after)
+        return self._days[day]